@@ -1,9 +1,16 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import json
+from pandas.io.json import ujson_loads
 from datetime import datetime
 from PIL import Image
 import os
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import pyarrow as pa
+import redis
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -22,7 +29,8 @@ def load_db_env():
         "DB_PASSWORD": os.getenv('DB_PASSWORD', 'bens'),
         "DB_HOST": os.getenv('DB_HOST', 'postgres'),
         "DB_PORT": os.getenv('DB_PORT', '5433'),
-        "DB_NAME": os.getenv('DB_NAME', 'weather_app')
+        "DB_NAME": os.getenv('DB_NAME', 'weather_app'),
+        "REDIS_URL": os.getenv('REDIS_URL')
     }
 
 # -- Database connection with SQLAlchemy
@@ -35,8 +43,8 @@ def get_db_engine():
         # Create connection string
         connection_string = f"postgresql://{db_config['DB_USERNAME']}:{db_config['DB_PASSWORD']}@{db_config['DB_HOST']}:{db_config['DB_PORT']}/{db_config['DB_NAME']}"
         
-        # Create engine
-        engine = create_engine(connection_string)
+        # Create engine with a small fixed pool; the dashboard only runs a few queries per rerun
+        engine = create_engine(connection_string, pool_size=2, max_overflow=0, pool_pre_ping=True)
         
         # Test connection
         with engine.connect() as conn:
@@ -47,56 +55,164 @@ def get_db_engine():
         st.error(f"❌ Database connection failed: {e}")
         return None
 
+# -- Shared Redis cache (enabled when REDIS_URL is set)
+REDIS_URL = load_db_env()["REDIS_URL"]
+
+@st.cache_resource
+def get_redis_client():
+    """Create a Redis client with short timeouts so an unreachable host fails fast."""
+    return redis.Redis.from_url(REDIS_URL, socket_connect_timeout=2, socket_timeout=2)
+
+def clear_redis_cache():
+    """Delete all cached dashboard results from Redis."""
+    client = get_redis_client()
+    keys = list(client.scan_iter("weather:*"))
+    if keys:
+        client.delete(*keys)
+
+# Seconds to skip Redis after it fails, serving a short-lived per-process cache instead
+REDIS_RETRY_SECONDS = 30
+
+@st.cache_resource
+def get_redis_status():
+    """Process-wide record of when Redis may be tried again after a failure."""
+    return {"retry_at": 0.0}
+
+def redis_cache(ttl):
+    """Cache DataFrame results in Redis as Arrow IPC bytes so all Streamlit workers share them.
+    
+    Without REDIS_URL this falls back to the per-process st.cache_data.
+    """
+    def decorator(func):
+        if not REDIS_URL:
+            return st.cache_data(ttl=ttl)(func)
+        
+        fallback = st.cache_data(ttl=REDIS_RETRY_SECONDS)(func)
+        
+        def mark_redis_down(error):
+            get_redis_status()["retry_at"] = time.monotonic() + REDIS_RETRY_SECONDS
+            st.warning(f"⚠️ Redis cache unavailable, retrying in {REDIS_RETRY_SECONDS}s: {error}")
+        
+        @functools.wraps(func)
+        def wrapper(*args):
+            if time.monotonic() < get_redis_status()["retry_at"]:
+                return fallback(*args)
+            
+            client = get_redis_client()
+            key = f"weather:{func.__name__}:" + ":".join(str(arg) for arg in args)
+            try:
+                cached = client.get(key)
+            except redis.RedisError as e:
+                mark_redis_down(e)
+                return fallback(*args)
+            if cached is not None:
+                try:
+                    return pa.ipc.deserialize_pandas(cached)
+                except pa.ArrowException:
+                    pass  # Unreadable entry; reload and overwrite it below
+            
+            df = func(*args)
+            if not df.empty:
+                try:
+                    client.setex(key, ttl, pa.ipc.serialize_pandas(df).to_pybytes())
+                except redis.RedisError as e:
+                    mark_redis_down(e)
+                except pa.ArrowException:
+                    pass  # Frame cannot be cached; serve it uncached
+            return df
+        return wrapper
+    return decorator
+
+# -- Load the available date range from the database
+@redis_cache(ttl=300)  # Cache for 5 minutes
+def load_data_range():
+    """Get the datetime bounds and count of current weather records."""
+    engine = get_db_engine()
+    if engine is None:
+        return pd.DataFrame()
+    
+    try:
+        query = """
+        SELECT 
+            MIN(datetime) AS min_datetime,
+            MAX(datetime) AS max_datetime,
+            COUNT(*) AS total_records
+        FROM calgary_weather_data
+        WHERE is_current = TRUE
+        """
+        
+        with engine.connect() as connection:
+            df = pd.read_sql_query(text(query), connection, parse_dates=["min_datetime", "max_datetime"])
+        
+        if df.loc[0, "total_records"] == 0:
+            return pd.DataFrame()
+        
+        return df
+        
+    except Exception as e:
+        st.error(f"❌ Error loading data range from database: {e}")
+        return pd.DataFrame()
+
+# -- Parse a single weather_info value
+def parse_weather_info(value):
+    """Return weather_info as a dict; malformed values become an empty dict so only that row falls back to defaults."""
+    # JSONB comes back as dicts; plain JSON/text columns come back as strings
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        try:
+            parsed = ujson_loads(value)
+        except ValueError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
+
 # -- Load data from database using SQLAlchemy
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def load_weather_data():
-    """Load weather data from PostgreSQL database using SQLAlchemy."""
+@redis_cache(ttl=300)  # Cache for 5 minutes
+def load_weather_data(start_date, end_date):
+    """Load current weather records between start_date and end_date from PostgreSQL."""
     engine = get_db_engine()
     if engine is None:
         return pd.DataFrame()
     
     try:
-        # Query to get weather data
+        # Filter in the database so only the selected range is transferred
         query = """
         SELECT 
             datetime,
             conv_temp,
             weather_info
         FROM calgary_weather_data
-        ORDER BY datetime DESC
+        WHERE is_current = TRUE
+          AND datetime BETWEEN :start_date AND :end_date
         """
         
         # Use SQLAlchemy to execute query and load into DataFrame
+        # Stream rows from a server-side cursor instead of buffering the whole result client-side
         with engine.connect() as connection:
-            df = pd.read_sql_query(text(query), connection, parse_dates=["datetime"])
+            connection = connection.execution_options(stream_results=True, yield_per=10000)
+            chunks = pd.read_sql_query(
+                text(query),
+                connection,
+                params={"start_date": start_date, "end_date": end_date},
+                parse_dates=["datetime"],
+                chunksize=10000
+            )
+            df = pd.concat(chunks, ignore_index=True)
+        
+        # Sort once here; the table and chart reuse this order
+        df.sort_values("datetime", inplace=True, ignore_index=True)
         
         # Parse weather info column - SQLAlchemy may return JSON as dict or string depending on configuration
         if "weather_info" in df.columns and df["weather_info"].notna().any():
             try:
-                # Handle both dict and string cases
-                def parse_weather_value(weather_data, key):
-                    if pd.isna(weather_data):
-                        return "Unknown" if key == "weather" else "No description"
-                    
-                    # If it's already a dictionary (SQLAlchemy with JSON support)
-                    if isinstance(weather_data, dict):
-                        return weather_data.get(key, "Unknown" if key == "weather" else "No description")
-                    # If it's a string, try to parse as JSON
-                    elif isinstance(weather_data, str):
-                        try:
-                            parsed = json.loads(weather_data)
-                            return parsed.get(key, "Unknown" if key == "weather" else "No description")
-                        except json.JSONDecodeError:
-                            return "Unknown" if key == "weather" else "No description"
-                    else:
-                        return "Unknown" if key == "weather" else "No description"
-                
-                df["weather_main"] = df["weather_info"].apply(
-                    lambda x: parse_weather_value(x, "weather")
-                )
-                df["weather_description"] = df["weather_info"].apply(
-                    lambda x: parse_weather_value(x, "description")
-                )
+                weather_info = df["weather_info"].dropna().map(parse_weather_info)
+
+                parsed = pd.json_normalize(weather_info.tolist()).reindex(columns=["weather", "description"])
+                parsed.index = weather_info.index
+                parsed = parsed.reindex(df.index)
+                df["weather_main"] = parsed["weather"].fillna("Unknown")
+                df["weather_description"] = parsed["description"].fillna("No description")
                 
             except Exception as e:
                 st.error(f"Error parsing weather_info: {e}")
@@ -104,49 +220,118 @@ def load_weather_data():
                 df["weather_main"] = "Unknown"
                 df["weather_description"] = "No description"
         
+        # weather_info is fully parsed above; drop it so cached frames stay flat
+        df = df.drop(columns="weather_info", errors="ignore")
+        
+        # Repeated labels take far less memory and filter faster as categoricals
+        for col in ("weather_main", "weather_description", "location"):
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+        
         return df
         
     except Exception as e:
         st.error(f"❌ Error loading data from database: {e}")
         return pd.DataFrame()
 
+# -- Download weather icons once per process
+# Seconds before a failed icon download is attempted again
+ICON_RETRY_SECONDS = 300
+
+@st.cache_resource
+def get_icon_store():
+    """Process-wide store of downloaded icon bytes and retry times for failed URLs."""
+    return {"images": {}, "retry_at": {}}
+
+def load_weather_icons(icon_map):
+    """Fetch missing icons concurrently; failed downloads fall back to the URL and are retried later."""
+    store = get_icon_store()
+    now = time.monotonic()
+    missing = {
+        url for url in set(icon_map.values())
+        if url not in store["images"] and now >= store["retry_at"].get(url, 0.0)
+    }
+    
+    if missing:
+        with requests.Session() as session:
+            def fetch_icon(url):
+                try:
+                    response = session.get(url, timeout=2)
+                    response.raise_for_status()
+                    return url, response.content
+                except requests.RequestException:
+                    return url, None
+            
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                for url, content in executor.map(fetch_icon, missing):
+                    if content is None:
+                        store["retry_at"][url] = now + ICON_RETRY_SECONDS
+                    else:
+                        store["images"][url] = content
+    
+    return {weather: store["images"].get(url, url) for weather, url in icon_map.items()}
+
+# -- Filter helpers for categorical columns
+def category_mask(series, value):
+    """Boolean mask of rows equal to value, compared on the categorical codes."""
+    return series.cat.codes.to_numpy() == series.cat.categories.get_loc(value)
+
+def observed_categories(series, mask):
+    """Categories that occur in the rows selected by mask."""
+    codes = np.unique(series.cat.codes.to_numpy()[mask])
+    return series.cat.categories[codes[codes >= 0]]
+
 # -- Initialize the app
 st.set_page_config(page_title="Weather Dashboard", layout="wide")
 st.title("🌦️ Weather Dashboard")
 
-# -- Load data
-df = load_weather_data()
+# -- Load data range
+data_range = load_data_range()
 
-if df.empty:
+if data_range.empty:
     st.warning("⚠️ No data found in the database. Please check your connection and data.")
     st.stop()
 
+data_range = data_range.iloc[0]
+
 # -- Date Range Filter
 st.sidebar.subheader("🔍 Filters")
 date_range = st.sidebar.date_input(
     "📅 Select Date Range",
-    [df["datetime"].min().date(), df["datetime"].max().date()]
+    [data_range["min_datetime"].date(), data_range["max_datetime"].date()]
 )
 
 if len(date_range) == 2:
     start_date, end_date = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
-    df_filtered = df[(df["datetime"] >= start_date) & (df["datetime"] <= end_date)]
 else:
-    df_filtered = df.copy()
+    start_date, end_date = data_range["min_datetime"], data_range["max_datetime"]
+
+# -- Load data for the selected range
+df = load_weather_data(start_date, end_date)
+
+if df.empty:
+    st.info("ℹ️ No weather records found for the selected date range.")
+    st.stop()
+
+# -- Build one row mask for all remaining filters and apply it once
+mask = np.ones(len(df), dtype=bool)
 
 # -- Location Filter (if available)
-if "location" in df_filtered.columns and df_filtered["location"].nunique() > 1:
-    locations = df_filtered["location"].unique()
+if "location" in df.columns and df["location"].nunique() > 1:
+    locations = observed_categories(df["location"], mask)
     selected_location = st.sidebar.selectbox("📍 Select Location", ["All"] + list(locations))
     if selected_location != "All":
-        df_filtered = df_filtered[df_filtered["location"] == selected_location]
+        mask &= category_mask(df["location"], selected_location)
 
 # -- Weather Type Filter (if available)
-if "weather_main" in df_filtered.columns and df_filtered["weather_main"].nunique() > 1:
-    weather_types = df_filtered["weather_main"].unique()
-    selected_weather = st.sidebar.selectbox("🌤️ Filter by Weather Type", ["All"] + list(weather_types))
-    if selected_weather != "All":
-        df_filtered = df_filtered[df_filtered["weather_main"] == selected_weather]
+if "weather_main" in df.columns:
+    weather_types = observed_categories(df["weather_main"], mask)
+    if len(weather_types) > 1:
+        selected_weather = st.sidebar.selectbox("🌤️ Filter by Weather Type", ["All"] + list(weather_types))
+        if selected_weather != "All":
+            mask &= category_mask(df["weather_main"], selected_weather)
+
+df_filtered = df.iloc[np.flatnonzero(mask)]
 
 # -- Show data summary
 st.sidebar.subheader("📊 Summary")
@@ -165,15 +350,15 @@ with col1:
     if "location" in df_filtered.columns:
         display_columns.append("location")
     
-    st.dataframe(df_filtered[display_columns].sort_values("datetime"), use_container_width=True)
+    st.dataframe(df_filtered[display_columns], use_container_width=True)
 
 with col2:
     st.subheader("ℹ️ Database Info")
     db_config = load_db_env()
     st.write(f"**Host:** {db_config['DB_HOST']}:{db_config['DB_PORT']}")
     st.write(f"**Database:** {db_config['DB_NAME']}")
-    st.write(f"**Total records:** {len(df)}")
-    st.write(f"**Date range:** {df['datetime'].min().strftime('%Y-%m-%d')} to {df['datetime'].max().strftime('%Y-%m-%d')}")
+    st.write(f"**Total records:** {data_range['total_records']}")
+    st.write(f"**Date range:** {data_range['min_datetime'].strftime('%Y-%m-%d')} to {data_range['max_datetime'].strftime('%Y-%m-%d')}")
 
 # -- Display Weather Conditions with Icons
 st.subheader("🌤️ Weather Conditions with Icons")
@@ -188,33 +373,45 @@ weather_icon_map = {
     "Mist": "https://img.icons8.com/emoji/96/000000/fog-emoji.png",
     "Fog": "https://img.icons8.com/emoji/96/000000/fog-emoji.png"
 }
+weather_icons = load_weather_icons(weather_icon_map)
 
 # Display recent weather entries
-for _, row in df_filtered.head(30).iterrows():  # Show first 30 entries
+df_recent = df_filtered.tail(30).iloc[::-1]  # Show the 30 latest entries
+times = df_recent["datetime"].dt.strftime("%Y-%m-%d %H:%M").to_numpy()
+icons = df_recent["weather_main"].map(weather_icons).to_numpy() if "weather_main" in df_recent.columns else [None] * len(df_recent)
+temps = df_recent["conv_temp"].round(1).to_numpy() if "conv_temp" in df_recent.columns else None
+descriptions = df_recent["weather_description"].str.capitalize().to_numpy() if "weather_description" in df_recent.columns else None
+locations = df_recent["location"].to_numpy() if "location" in df_recent.columns else None
+
+for i in range(len(df_recent)):
     col1, col2, col3, col4 = st.columns([2, 1, 2, 3])
     with col1:
-        st.write(row["datetime"].strftime("%Y-%m-%d %H:%M"))
+        st.write(times[i])
     with col2:
-        icon_url = weather_icon_map.get(row.get("weather_main", "Unknown"), None)
-        if icon_url:
-            st.image(icon_url, width=50)
+        if pd.notna(icons[i]):
+            st.image(icons[i], width=50)
     with col3:
-        if "conv_temp" in row:
-            st.metric(label="Temp (°C)", value=round(row["conv_temp"], 1))
+        if temps is not None:
+            st.metric(label="Temp (°C)", value=temps[i])
     with col4:
-        if "weather_description" in row:
-            st.caption(row["weather_description"].capitalize())
-        if "location" in row:
-            st.caption(f"📍 {row['location']}")
+        if descriptions is not None:
+            st.caption(descriptions[i])
+        if locations is not None:
+            st.caption(f"📍 {locations[i]}")
 
 # -- Temperature Line Chart
 if "conv_temp" in df_filtered.columns:
     st.subheader("📈 Temperature Over Time")
     if not df_filtered.empty:
-        chart_df = df_filtered[["datetime", "conv_temp"]].set_index("datetime").sort_index()
+        chart_df = df_filtered[["datetime", "conv_temp"]].set_index("datetime")
         st.line_chart(chart_df)
 
 # -- Refresh button
 if st.button("🔄 Refresh Data"):
     st.cache_data.clear()
+    if REDIS_URL:
+        try:
+            clear_redis_cache()
+        except redis.RedisError as e:
+            st.warning(f"⚠️ Redis cache unavailable: {e}")
     st.rerun()
\ No newline at end of file
@@ -1,12 +1,28 @@
+import os
+from datetime import datetime
 import streamlit as st
-import pandas as pd
+import polars as pl
+
+CSV_PATH = "weather_forecast_json.csv"
+PARQUET_PATH = "weather_forecast.parquet"
 
 # Load data
 @st.cache_data
-def load_weather_data():
-    return pd.read_csv("weather_forecast_json.csv", parse_dates=["datetime"])
-
-df = load_weather_data()
+def load_weather_data(csv_mtime):
+    """Load the forecast CSV, reusing its Parquet copy until the CSV changes."""
+    if os.path.exists(PARQUET_PATH) and os.path.getmtime(PARQUET_PATH) >= csv_mtime:
+        return pl.read_parquet(PARQUET_PATH)
+
+    df = pl.read_csv(CSV_PATH, try_parse_dates=True)
+    if 'location' in df.columns:
+        df = df.with_columns(pl.col('location').cast(pl.Categorical))
+    # Write beside the target and swap it in, so readers never see a partial file
+    tmp_path = f"{PARQUET_PATH}.{os.getpid()}.tmp"
+    df.write_parquet(tmp_path, compression="zstd")
+    os.replace(tmp_path, PARQUET_PATH)
+    return df
+
+df = load_weather_data(os.path.getmtime(CSV_PATH))
 
 st.title("Weather Data Dashboard")
 
@@ -16,24 +32,26 @@ date_range = st.date_input(
     [df['datetime'].min(), df['datetime'].max()]
 )
 if len(date_range) == 2:
-    df = df[(df['datetime'] >= pd.to_datetime(date_range[0])) & (df['datetime'] <= pd.to_datetime(date_range[1]))]
+    start_date = datetime.combine(date_range[0], datetime.min.time())
+    end_date = datetime.combine(date_range[1], datetime.min.time())
+    df = df.filter((pl.col('datetime') >= start_date) & (pl.col('datetime') <= end_date))
 
 # Location filter (if you have a 'location' column)
 if 'location' in df.columns:
-    location = st.selectbox("Select location", df['location'].unique())
-    df = df[df['location'] == location]
+    location = st.selectbox("Select location", df['location'].unique().to_list())
+    df = df.filter(pl.col('location') == location)
 
 # Show data
-st.write("Filtered Data", df.head())
+st.write("Filtered Data", df.head().to_pandas())
 
 # Line chart (e.g., temperature over time)
 if 'conv_temp' in df.columns:
-    st.line_chart(df.set_index('datetime')['conv_temp'])
+    st.line_chart(df.select(['datetime', 'conv_temp']).to_pandas().set_index('datetime')['conv_temp'])
 
 # More visualizations
 if 'precipitation' in df.columns:
-    st.bar_chart(df.set_index('datetime')['precipitation'])
+    st.bar_chart(df.select(['datetime', 'precipitation']).to_pandas().set_index('datetime')['precipitation'])
 
 # Map (if you have lat/lon)
 if {'latitude', 'longitude'}.issubset(df.columns):
-    st.map(df[['latitude', 'longitude']])
\ No newline at end of file
+    st.map(df.select(['latitude', 'longitude']).to_pandas())
\ No newline at end of file
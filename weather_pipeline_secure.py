@@ -1,13 +1,17 @@
 # Weather Data Pipeline - Secure Version
 # This script uses environment variables for sensitive configuration
 
+import io
 import json
 import requests
 import csv
+import numpy as np
 import pandas as pd
+from pandas.io.json import ujson_loads
 from datetime import datetime
 import os
 import psycopg2
+import redis
 from sqlalchemy import create_engine, text
 from sqlalchemy.dialects.postgresql import JSONB
 from dotenv import load_dotenv
@@ -26,6 +30,9 @@ DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '5433')
 DB_NAME = os.getenv('DB_NAME', 'weather_app')
 
+# Optional Redis cache shared by the Streamlit dashboard
+REDIS_URL = os.getenv('REDIS_URL')
+
 # Validate required environment variables
 if not API_KEY:
     raise ValueError("OPENWEATHER_API_KEY environment variable is required")
@@ -44,29 +51,29 @@ def main_request(baseurl, endpoint):
     """Make API request to OpenWeatherMap"""
     url = f"{baseurl}{endpoint}"
     r = requests.get(url)
-    return r.json()
+    r.raise_for_status()
+    return ujson_loads(r.content)
+
+def kelvin_to_celsius(temps):
+    """Convert an array of Kelvin temperatures to Celsius, rounded to 2 decimals"""
+    return np.round(np.asarray(temps, dtype=np.float64) - 273.15, 2)
 
 def parse_list(response):
-    """Parse weather data from API response"""
-    charlist = []
-    for item in response['list']:
-        dt = item['dt_txt']
-        temp = item['main']['temp']
-        weather_info = {
-            "weather": item['weather'][0]['main'],
-            "description": item['weather'][0]['description']
-        }
-        conv_temp = temp - 273.15
-        print(f"{dt}: {temp}K", {weather_info['weather']}, {weather_info['description']})
-        
-        char = {
-            "datetime": dt,
-            "temperature": temp,
-            "weather_info": json.dumps(weather_info),
-            "conv_temp": round(conv_temp, 2)
-        }
-        charlist.append(char)
-    return charlist
+    """Parse weather data from API response into a DataFrame"""
+    if not response['list']:
+        return pd.DataFrame(columns=['datetime', 'temperature', 'weather_info', 'conv_temp'])
+
+    flat = pd.json_normalize(response['list'], sep='_')
+    weather = flat['weather'].str[0]
+
+    df = flat.rename(columns={'dt_txt': 'datetime', 'main_temp': 'temperature'})[['datetime', 'temperature']]
+    # Encoded once here and reused for both the CSV and the COPY into the JSONB stage column
+    df['weather_info'] = [
+        json.dumps({"weather": w, "description": d})
+        for w, d in zip(weather.str['main'], weather.str['description'])
+    ]
+    df['conv_temp'] = kelvin_to_celsius(df['temperature'].to_numpy())
+    return df
 
 def create_database_engine():
     """Create SQLAlchemy engine with secure credentials"""
@@ -89,43 +96,83 @@ def create_weather_table(engine):
                 UNIQUE(datetime, valid_from)
             );
         """))
+        # Dashboard queries filter current records by datetime range
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_calgary_weather_data_current_datetime
+            ON calgary_weather_data (datetime)
+            WHERE is_current;
+        """))
+        # Staging rows are regenerated from the API every run, so skip WAL for them
+        conn.execute(text("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS weather_stage (
+                datetime TIMESTAMP,
+                temperature DECIMAL(5,2),
+                conv_temp DECIMAL(5,2),
+                weather_info JSONB
+            );
+        """))
 
-def upsert_weather_scd_type2(engine, new_data):
+def upsert_weather_scd_type2(engine, weather_df):
     """Upsert weather data using SCD Type 2 methodology"""
     with engine.begin() as conn:
-        # Expire current record if data has changed
+        # Stage the whole batch so the merge runs as set-based statements
+        stage_df = weather_df[['datetime', 'temperature', 'conv_temp', 'weather_info']]
+        conn.execute(text("TRUNCATE weather_stage;"))
+
+        # Bulk load the stage table with COPY rather than row-wise INSERTs
+        buf = io.StringIO()
+        stage_df.to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        with conn.connection.cursor() as cur:
+            cur.copy_expert(
+                "COPY weather_stage (datetime, temperature, conv_temp, weather_info) FROM STDIN WITH CSV",
+                buf
+            )
+
+        # Expire current records whose data has changed
         expire_query = text("""
-            UPDATE calgary_weather_data
+            UPDATE calgary_weather_data t
             SET valid_to = NOW(), is_current = FALSE
-            WHERE datetime = :datetime
-              AND is_current = TRUE
+            FROM weather_stage s
+            WHERE t.datetime = s.datetime
+              AND t.is_current = TRUE
               AND (
-                  temperature != :temperature OR
-                  conv_temp != :conv_temp OR
-                  weather_info != :weather_info
+                  t.temperature != s.temperature OR
+                  t.conv_temp != s.conv_temp OR
+                  t.weather_info != s.weather_info
               );
         """)
-        conn.execute(expire_query, new_data)
+        conn.execute(expire_query)
 
-        # Insert new current record if not already there
+        # Insert new current records if not already there
         insert_query = text("""
             INSERT INTO calgary_weather_data (
                 datetime, temperature, conv_temp, weather_info,
                 valid_from, valid_to, is_current
             )
             SELECT 
-                :datetime, :temperature, :conv_temp, :weather_info,
+                s.datetime, s.temperature, s.conv_temp, s.weather_info,
                 NOW(), NULL, TRUE
+            FROM weather_stage s
             WHERE NOT EXISTS (
-                SELECT 1 FROM calgary_weather_data
-                WHERE datetime = :datetime
-                  AND temperature = :temperature
-                  AND conv_temp = :conv_temp
-                  AND weather_info = :weather_info
-                  AND is_current = TRUE
+                SELECT 1 FROM calgary_weather_data t
+                WHERE t.datetime = s.datetime
+                  AND t.temperature = s.temperature
+                  AND t.conv_temp = s.conv_temp
+                  AND t.weather_info = s.weather_info
+                  AND t.is_current = TRUE
             );
         """)
-        conn.execute(insert_query, new_data)
+        conn.execute(insert_query)
+
+def invalidate_dashboard_cache():
+    """Delete cached dashboard query results so the next load reads fresh data"""
+    if not REDIS_URL:
+        return
+    client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=2, socket_timeout=2)
+    keys = list(client.scan_iter('weather:*'))
+    if keys:
+        client.delete(*keys)
 
 def main():
     """Main pipeline execution"""
@@ -135,21 +182,17 @@ def main():
     print("1. Extracting data from OpenWeatherMap API...")
     baseurl = 'http://api.openweathermap.org/data/2.5/forecast?q='
     endpoint = f'{CITY}&cnt={cnt}&appid={API_KEY}'
-    url = f"http://api.openweathermap.org/data/2.5/forecast?q={CITY}&cnt={cnt}&appid={API_KEY}"
-    
-    response = requests.get(url)
     
-    if response.status_code == 200:
+    try:
         data = main_request(baseurl, endpoint)
         print("✓ API data extracted successfully")
-    else:
-        print(f"✗ Failed to retrieve data. Status code: {response.status_code}")
+    except requests.HTTPError as e:
+        print(f"✗ Failed to retrieve data. Status code: {e.response.status_code}")
         return
     
     # Step 2: Transform data
     print("2. Transforming data...")
-    parsed_data = parse_list(data)
-    weather_df = pd.DataFrame(parsed_data)
+    weather_df = parse_list(data)
     weather_df['valid_from'] = datetime.now()
     print("✓ Data transformation completed")
     
@@ -165,17 +208,15 @@ def main():
         create_weather_table(engine)
         
         # Insert data using SCD Type 2
-        for _, row in weather_df.iterrows():
-            new_data = {
-                'datetime': row['datetime'],
-                'temperature': row['temperature'],
-                'conv_temp': row['conv_temp'],
-                'weather_info': row['weather_info']
-            }
-            upsert_weather_scd_type2(engine, new_data)
+        upsert_weather_scd_type2(engine, weather_df)
         
         print("✓ Data loaded to database successfully")
         
+        try:
+            invalidate_dashboard_cache()
+        except redis.RedisError as e:
+            print(f"✗ Could not invalidate dashboard cache: {e}")
+        
         # Step 5: Verify data
         print("5. Verifying data...")
         with engine.connect() as conn: